@@ -1,363 +1,730 @@
-import streamlit as st
-from supabase import create_client
-import requests
-import json
-import time
-
-# -------------------- APP CONFIG --------------------
-st.set_page_config(page_title="Cross-Culture Humor Mapper", page_icon="🌍", layout="centered")
-
-# -------------------- SECRETS --------------------
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-OPENROUTER_API_KEY = st.secrets["OPENROUTER_API_KEY"]
-
-# -------------------- FREE MODELS LIST --------------------
-FREE_MODELS = [
-    "mistralai/mistral-small-3.2-24b-instruct:free",
-    "meta-llama/llama-3-8b-instruct:free", 
-    "google/gemma-7b-it:free",
-    "nousresearch/nous-hermes-2-mixtral-8x7b-dpo:free",
-    "google/gemma-2b-it:free",
-    "meta-llama/llama-2-13b-chat:free",
-    "microsoft/wizardlm-2-8x22b:free",
-    "undi95/toppy-m-7b:free"
-]
-
-# -------------------- FUNCTIONS --------------------
-def get_supabase_client():
-    """Create a new Supabase client for each user session."""
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
-
-def signup(email, password):
-    """Register a new user."""
-    try:
-        client = get_supabase_client()
-        client.auth.sign_up({"email": email, "password": password})
-        st.success("✅ Account created! Please log in now.")
-    except Exception as e:
-        st.error(f"❌ Signup failed: {e}")
-
-def login(email, password):
-    """Authenticate a user."""
-    try:
-        client = get_supabase_client()
-        user_session = client.auth.sign_in_with_password({"email": email, "password": password})
-        if user_session and user_session.user:
-            st.session_state["logged_in"] = True
-            st.session_state["user_email"] = email
-            st.session_state["supabase_client"] = client
-            st.toast(f"Welcome, {email}! 🎉", icon="✅")
-        else:
-            st.error("Invalid credentials.")
-    except Exception as e:
-        st.error(f"❌ Login failed: {e}")
-
-def logout():
-    """Logout the current user."""
-    if "supabase_client" in st.session_state:
-        try:
-            st.session_state["supabase_client"].auth.sign_out()
-        except Exception:
-            pass
-    st.session_state.clear()
-    st.info("👋 Logged out successfully!")
-    st.stop()
-
-def save_translation_to_db(input_text, target_culture, translated_text, model_used):
-    """Save translation to Supabase database."""
-    try:
-        client = st.session_state.get("supabase_client")
-        if client:
-            data = {
-                "user_email": st.session_state["user_email"],
-                "original_text": input_text,
-                "target_culture": target_culture,
-                "translated_text": translated_text,
-                "model_used": model_used
-            }
-            response = client.table("humor_translations").insert(data).execute()
-            return response.data
-    except Exception as e:
-        st.error(f"❌ Failed to save translation: {e}")
-    return None
-
-def get_user_translations():
-    """Get user's previous translations."""
-    try:
-        client = st.session_state.get("supabase_client")
-        if client:
-            response = client.table("humor_translations")\
-                            .select("*")\
-                            .eq("user_email", st.session_state["user_email"])\
-                            .order("created_at", desc=True)\
-                            .limit(10)\
-                            .execute()
-            return response.data
-    except Exception as e:
-        st.error(f"❌ Failed to load history: {e}")
-    return []
-
-def smart_translate_humor(input_text, target_culture, max_attempts=3):
-    """
-    Use multiple free models with fallback system.
-    Returns: (translated_text, model_used, attempts)
-    """
-    prompt = (
-        f"Translate or adapt the following joke or phrase into humor suitable for {target_culture} culture. "
-        f"Maintain the spirit of the joke but make it funny and understandable to that culture.\n\n"
-        f"Input: {input_text}\n\nTranslated Humor:"
-    )
-
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    attempts = []
-    
-    for i, model in enumerate(FREE_MODELS[:max_attempts]):
-        try:
-            model_name = model.split('/')[-1]
-            attempts.append(f"Attempt {i+1}: {model_name}")
-            
-            if max_attempts > 1:
-                st.write(f"🔄 **Trying:** {model_name}...")
-            
-            body = {
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 500,
-                "temperature": 0.7
-            }
-
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(body),
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if "choices" in data:
-                    translated_text = data["choices"][0]["message"]["content"]
-                    if len(translated_text.strip()) > 10:
-                        if max_attempts > 1:
-                            st.success(f"✅ **Success with {model_name}!**")
-                        return translated_text, model, attempts
-                    else:
-                        st.warning(f"❌ {model_name} returned empty response")
-                        
-            else:
-                error_msg = f"HTTP {response.status_code}"
-                if response.status_code == 429:
-                    error_msg = "Rate limited"
-                elif response.status_code == 503:
-                    error_msg = "Service overloaded"
-                
-                if max_attempts > 1:
-                    st.warning(f"❌ {model_name} failed ({error_msg})")
-                
-            if i < max_attempts - 1:
-                time.sleep(2)
-                
-        except requests.exceptions.Timeout:
-            if max_attempts > 1:
-                st.warning(f"⏰ {model_name} timed out")
-            attempts.append(f"Attempt {i+1}: {model_name} - Timeout")
-        except Exception as e:
-            if max_attempts > 1:
-                st.warning(f"❌ {model_name} error: {str(e)[:50]}...")
-            attempts.append(f"Attempt {i+1}: {model_name} - Error")
-
-    return None, None, attempts
-
-# -------------------- UI --------------------
-st.title("🌍 Cross-Culture Humor Mapper")
-st.markdown("**Translate humor between cultures with AI-powered fun! 😄**")
-
-# -------------------- AUTH SECTION --------------------
-if "logged_in" not in st.session_state:
-    tab_login, tab_signup = st.tabs(["🔑 Login", "Signup"])
-
-    with tab_login:
-        email = st.text_input("Email", key="login_email")
-        password = st.text_input("Password", type="password", key="login_password")
-        if st.button("Login", use_container_width=True):
-            login(email, password)
-
-    with tab_signup:
-        email = st.text_input("Email", key="signup_email")
-        password = st.text_input("Password", type="password", key="signup_password")
-        if st.button("Sign Up", use_container_width=True):
-            signup(email, password)
-
-else:
-    st.success(f"✅ Logged in as {st.session_state['user_email']}")
-    
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        if st.button("Logout", use_container_width=True):
-            logout()
-    with col2:
-        if st.button("View History", use_container_width=True):
-            st.session_state["show_history"] = True
-
-    st.divider()
-    
-    if st.session_state.get("show_history"):
-        st.subheader("📜 Your Translation History")
-        translations = get_user_translations()
-        
-        if translations:
-            for i, translation in enumerate(translations):
-                with st.expander(f"Translation {i+1} - {translation['target_culture']}"):
-                    st.write(f"**Original:** {translation['original_text']}")
-                    st.write(f"**Translated:** {translation['translated_text']}")
-                    st.caption(f"Model: {translation['model_used']} | Created: {translation.get('created_at', '')}")
-        else:
-            st.info("No translations saved yet. Start translating below!")
-        
-        if st.button("Back to Translator"):
-            st.session_state["show_history"] = False
-        st.divider()
-
-    if not st.session_state.get("show_history"):
-        st.subheader("Humor Translator")
-        
-        input_text = st.text_area(
-            "Enter a joke or funny phrase:", 
-            placeholder="Type something like 'Why did the chicken cross the road?'",
-            height=100
-        )
-        
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-            target_culture = st.text_input(
-                "Target culture:", 
-                placeholder="e.g., Japanese, Indian, German, Corporate, Gen Z"
-            )
-        
-        with col2:
-            max_attempts = st.selectbox("Models to try", [1, 2, 3], index=2, help="How many AI models to try if one fails")
-
-        with st.expander("⚙️ Advanced Options"):
-            save_translation = st.checkbox("Save to my history", value=True)
-            show_debug = st.checkbox("Show debug information", value=False)
-
-        if st.button("Translate Humor 🎉", use_container_width=True, type="primary"):
-            if not input_text or not target_culture:
-                st.warning("Please fill in both fields.")
-            else:
-                with st.spinner("Finding the best AI model for your humor... 🤖💬"):
-                    translated_text, model_used, attempts = smart_translate_humor(
-                        input_text, target_culture, max_attempts
-                    )
-                    
-                    if translated_text:
-                        st.success("✅ Culturally adapted humor:")
-                        st.markdown(f"### {translated_text}")
-
-                        # ---- TEXT TO SPEECH SECTION (FREE) ----
-                        import streamlit.components.v1 as components
-
-                        # Optional: simple language accent mapping
-                        lang_map = {
-                            "indian": "hi-IN",
-                            "japanese": "ja-JP",
-                            "german": "de-DE",
-                            "french": "fr-FR",
-                            "chinese": "zh-CN",
-                            "gen z": "en-US",
-                            "corporate": "en-GB"
-                        }
-                        lang_code = lang_map.get(target_culture.strip().lower(), "en-US")
-
-                        speak_button = f"""
-                        <script>
-                        function speakText(text, lang) {{
-                            const utterance = new SpeechSynthesisUtterance(text);
-                            utterance.lang = lang;
-                            utterance.rate = 1.0;
-                            utterance.pitch = 1.0;
-                            speechSynthesis.speak(utterance);
-                        }}
-                        </script>
-                        <button 
-                            style="background-color:#f0f0f0;
-                                   border:none;
-                                   border-radius:8px;
-                                   padding:8px 12px;
-                                   margin-top:10px;
-                                   cursor:pointer;
-                                   font-size:16px;">
-                            🔊 Click to Listen
-                        </button>
-                        <script>
-                        const button = document.currentScript.previousElementSibling;
-                        button.addEventListener('click', () => {{
-                            speakText({json.dumps(translated_text)}, {json.dumps(lang_code)});
-                        }});
-                        </script>
-                        """
-
-                        components.html(speak_button, height=60)
-
-                        if save_translation and model_used:
-                            save_translation_to_db(input_text, target_culture, translated_text, model_used)
-                            st.success("Saved to your history!")
-
-                        st.session_state.last_translation = {
-                            "original": input_text,
-                            "target": target_culture,
-                            "translated": translated_text,
-                            "model": model_used
-                        }
-
-                    else:
-                        st.error("😵 All AI models failed! Here's what happened:")
-                        st.write("### Attempt History:")
-                        for attempt in attempts:
-                            st.write(f"- {attempt}")
-                        st.info("""
-                        **💡 What to do now:**
-                        - Wait 5-10 minutes and try again
-                        - Try a shorter or simpler joke
-                        - Reduce the number of models to try
-                        - Free AI models often get busy during peak times
-                        """)
-
-        if show_debug:
-            st.divider()
-            st.subheader("🔧 Debug Information")
-            st.write("**Available free models:**")
-            for i, model in enumerate(FREE_MODELS[:5]):
-                st.write(f"{i+1}. {model}")
-            st.caption(f"... and {len(FREE_MODELS) - 5} more backup models")
-            if 'last_translation' in st.session_state:
-                st.write("**Last translation:**")
-                st.json(st.session_state.last_translation)
-
-        st.divider()
-        st.subheader("💡 Quick Tips")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.markdown("**Popular Cultures:**")
-            st.write("- Indian")
-            st.write("- Japanese")
-            st.write("- Gen Z")
-        with col2:
-            st.markdown("**Example Jokes:**")
-            st.write("- 'Knock knock' jokes")
-            st.write("- Puns")
-            st.write("- Meme phrases")
-        with col3:
-            st.markdown("**Best Practices:**")
-            st.write("- Be specific")
-            st.write("- Keep it clean")
-            st.write("- Have fun! 😄")
-
-st.markdown("---")
-st.caption("Powered by multiple free AI models | Automatic fallback system | Your humor, globally understood!")
+import streamlit as st
+import streamlit.components.v1 as components
+from supabase import create_client
+import asyncio
+import collections
+import concurrent.futures
+import httpx
+import orjson
+import queue
+import random
+import threading
+import time
+from types import MappingProxyType
+
+# -------------------- APP CONFIG --------------------
+st.set_page_config(page_title="Cross-Culture Humor Mapper", page_icon="🌍", layout="centered")
+
+# -------------------- SECRETS --------------------
+try:
+    SUPABASE_URL = st.secrets["SUPABASE_URL"]
+    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
+    OPENROUTER_API_KEY = st.secrets["OPENROUTER_API_KEY"]
+except KeyError as e:
+    st.error(f"❌ Missing secret {e} — add it to .streamlit/secrets.toml before running the app.")
+    st.stop()
+
+if not (SUPABASE_URL and SUPABASE_KEY and OPENROUTER_API_KEY):
+    st.error("❌ One or more secrets are empty — check .streamlit/secrets.toml.")
+    st.stop()
+
+# Built once at import; read-only so nothing downstream can mutate it
+OPENROUTER_HEADERS = MappingProxyType({
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json"
+})
+
+# -------------------- FREE MODELS LIST --------------------
+FREE_MODELS = [
+    "mistralai/mistral-small-3.2-24b-instruct:free",
+    "meta-llama/llama-3-8b-instruct:free", 
+    "google/gemma-7b-it:free",
+    "nousresearch/nous-hermes-2-mixtral-8x7b-dpo:free",
+    "google/gemma-2b-it:free",
+    "meta-llama/llama-2-13b-chat:free",
+    "microsoft/wizardlm-2-8x22b:free",
+    "undi95/toppy-m-7b:free"
+]
+
+# -------------------- TEXT TO SPEECH (FREE) --------------------
+# Simple language accent mapping
+LANG_MAP = {
+    "indian": "hi-IN",
+    "japanese": "ja-JP",
+    "german": "de-DE",
+    "french": "fr-FR",
+    "chinese": "zh-CN",
+    "gen z": "en-US",
+    "corporate": "en-GB"
+}
+
+# Static template; {text} and {lang} are filled with JSON-encoded values
+TTS_TEMPLATE = """
+<script>
+function speakText(text, lang) {{
+    const utterance = new SpeechSynthesisUtterance(text);
+    utterance.lang = lang;
+    utterance.rate = 1.0;
+    utterance.pitch = 1.0;
+    speechSynthesis.speak(utterance);
+}}
+</script>
+<button
+    style="background-color:#f0f0f0;
+           border:none;
+           border-radius:8px;
+           padding:8px 12px;
+           margin-top:10px;
+           cursor:pointer;
+           font-size:16px;">
+    🔊 Click to Listen
+</button>
+<script>
+const button = document.currentScript.previousElementSibling;
+button.addEventListener('click', () => {{
+    speakText({text}, {lang});
+}});
+</script>
+"""
+
+# -------------------- FUNCTIONS --------------------
+@st.cache_resource
+def get_event_loop():
+    """Background event loop so the pooled HTTP client outlives reruns."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_http_client():
+    """Shared OpenRouter client: one connection pool, HTTP/2 multiplexed."""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        headers=dict(OPENROUTER_HEADERS)
+    )
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def get_free_models():
+    """
+    Filter FREE_MODELS down to the ids OpenRouter currently serves (cached
+    a day), so deprecated entries don't burn attempt slots with instant
+    404s. Falls back to the full hardcoded list if the catalog is down.
+    """
+    try:
+        response = httpx.get(
+            "https://openrouter.ai/api/v1/models",
+            headers=dict(OPENROUTER_HEADERS),
+            timeout=10
+        )
+        if response.status_code == 200:
+            catalog = {m["id"] for m in orjson.loads(response.content).get("data", [])}
+            live = [m for m in FREE_MODELS if m in catalog]
+            if live:
+                return live
+    except Exception:
+        pass
+    return FREE_MODELS
+
+@st.cache_resource
+def get_executor():
+    """Shared worker pool for Supabase I/O that shouldn't block the UI."""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def get_model_stats():
+    """
+    Rolling per-model health shared across users: success/failure counts
+    and a latency EWMA in seconds. Starts optimistic (1 success, 3s) so
+    unseen models still get tried.
+    """
+    return {
+        "lock": threading.Lock(),
+        "stats": collections.defaultdict(lambda: {"ok": 1, "fail": 0, "latency_ewma": 3.0})
+    }
+
+def _rank_models(model_stats, models):
+    """Order models by observed success rate, then by typical latency."""
+    with model_stats["lock"]:
+        def score(model):
+            s = model_stats["stats"][model]
+            return (-s["ok"] / (s["ok"] + s["fail"]), s["latency_ewma"])
+        return sorted(models, key=score)
+
+def _record_attempt(model_stats, model, succeeded, elapsed):
+    """Fold one attempt's outcome into the shared health stats."""
+    with model_stats["lock"]:
+        s = model_stats["stats"][model]
+        if succeeded:
+            s["ok"] += 1
+            s["latency_ewma"] = 0.7 * s["latency_ewma"] + 0.3 * elapsed
+        else:
+            s["fail"] += 1
+
+@st.cache_resource
+def get_supabase_client():
+    """Return a shared Supabase client, built once per process."""
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@st.cache_resource
+def get_db_lock():
+    """
+    Serializes auth+execute pairs on the shared client. postgrest.auth
+    mutates the one process-wide Authorization header, so without this a
+    query could run under another session's JWT.
+    """
+    return threading.Lock()
+
+def signup(email, password):
+    """Register a new user."""
+    try:
+        client = get_supabase_client()
+        with get_db_lock():
+            client.auth.sign_up({"email": email, "password": password})
+        st.success("✅ Account created! Please log in now.")
+    except Exception as e:
+        st.error(f"❌ Signup failed: {e}")
+
+def login(email, password):
+    """Authenticate a user."""
+    try:
+        client = get_supabase_client()
+        # sign_in re-auths the shared postgrest client via supabase-py's
+        # auth listener, so it must not interleave with a running query
+        with get_db_lock():
+            user_session = client.auth.sign_in_with_password({"email": email, "password": password})
+        if user_session and user_session.user:
+            st.session_state["logged_in"] = True
+            st.session_state["user_email"] = email
+            st.session_state["access_token"] = user_session.session.access_token
+            prefetch_user_translations()
+            st.toast(f"Welcome, {email}! 🎉", icon="✅")
+        else:
+            st.error("Invalid credentials.")
+    except Exception as e:
+        st.error(f"❌ Login failed: {e}")
+
+def logout():
+    """Logout the current user, flushing any saves still in flight."""
+    for future in st.session_state.get("_pending_saves", []):
+        try:
+            future.result(timeout=2)
+        except Exception:
+            pass
+    st.session_state.clear()
+    st.info("👋 Logged out successfully!")
+    st.stop()
+
+def _insert_translation(client, db_lock, access_token, user_email, input_text,
+                        target_culture, translated_text, model_used):
+    """Blocking Supabase INSERT; runs on the worker pool."""
+    data = {
+        "user_email": user_email,
+        "original_text": input_text,
+        "target_culture": target_culture,
+        "translated_text": translated_text,
+        "model_used": model_used
+    }
+    with db_lock:
+        if access_token:
+            client.postgrest.auth(access_token)
+        return client.table("humor_translations").insert(data).execute().data
+
+def _fetch_translations(client, db_lock, access_token, user_email):
+    """
+    Blocking Supabase SELECT of recent history; runs on the worker pool.
+    Only fetches metadata for the list view — the (potentially multi-KB)
+    translation bodies are loaded per row via fetch_translation_body.
+    """
+    with db_lock:
+        if access_token:
+            client.postgrest.auth(access_token)
+        response = client.table("humor_translations")\
+                        .select("id, target_culture, created_at")\
+                        .eq("user_email", user_email)\
+                        .order("created_at", desc=True)\
+                        .limit(10)\
+                        .execute()
+    return response.data
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_translation_body(row_id):
+    """Fetch one translation's full text, only when its row is opened."""
+    client = get_supabase_client()
+    token = st.session_state.get("access_token")
+    with get_db_lock():
+        if token:
+            client.postgrest.auth(token)
+        return client.table("humor_translations")\
+                    .select("original_text, translated_text, model_used")\
+                    .eq("id", row_id)\
+                    .single()\
+                    .execute().data
+
+def save_translation_to_db(input_text, target_culture, translated_text, model_used):
+    """Queue the save in the background so the UI doesn't wait on the INSERT."""
+    future = get_executor().submit(
+        _insert_translation,
+        get_supabase_client(),
+        get_db_lock(),
+        st.session_state.get("access_token"),
+        st.session_state["user_email"],
+        input_text, target_culture, translated_text, model_used
+    )
+    st.session_state.setdefault("_pending_saves", []).append(future)
+    # Cached history is stale once a new row is on its way
+    st.session_state.pop("history", None)
+    return future
+
+def report_save_failures():
+    """
+    Surface errors from background saves. Fire-and-forget writes finish
+    after the rerun that queued them, so each rerun sweeps the finished
+    futures and reports any that raised.
+    """
+    still_pending = []
+    for future in st.session_state.get("_pending_saves", []):
+        if not future.done():
+            still_pending.append(future)
+        elif future.exception() is not None:
+            st.error(f"❌ Failed to save translation: {future.exception()}")
+    st.session_state["_pending_saves"] = still_pending
+
+def prefetch_user_translations():
+    """Kick off the history query so it's ready before the user asks for it."""
+    st.session_state["_history_future"] = get_executor().submit(
+        _fetch_translations,
+        get_supabase_client(),
+        get_db_lock(),
+        st.session_state.get("access_token"),
+        st.session_state["user_email"]
+    )
+
+def get_user_translations():
+    """Get user's previous translations, preferring the prefetched result."""
+    if "history" not in st.session_state:
+        future = st.session_state.pop("_history_future", None)
+        if future is None:
+            future = get_executor().submit(
+                _fetch_translations,
+                get_supabase_client(),
+                get_db_lock(),
+                st.session_state.get("access_token"),
+                st.session_state["user_email"]
+            )
+        try:
+            st.session_state["history"] = future.result(timeout=10)
+        except Exception as e:
+            st.error(f"❌ Failed to load history: {e}")
+            return []
+    return st.session_state["history"]
+
+# Longest Retry-After we honor before giving up on a model (seconds)
+RETRY_AFTER_BUDGET = 5
+
+def _retry_after_seconds(response):
+    """Parse the Retry-After header, or 0 if absent/unusable."""
+    try:
+        return int(response.headers.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0
+
+# Sentinel pushed onto the chunk queue when the stream is over
+_STREAM_DONE = object()
+
+def _release_claim(winner, model):
+    """Give up the race claim so a still-running candidate can take over."""
+    if winner["model"] == model:
+        winner["model"] = None
+
+async def _stream_model(client, model, prompt, winner, chunks, max_retries=3):
+    """
+    Stream one OpenRouter model, retrying rate-limit/overload responses with
+    capped exponential backoff. The first task to produce a content delta
+    claims the race via `winner` and forwards its deltas to `chunks`; the
+    others bail out once they notice they lost.
+    Returns (model, translated_text, error_msg) where exactly one of
+    text/error is set.
+    """
+    body = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 500,
+        "temperature": 0.7,
+        "stream": True
+    }
+
+    error_msg = "No response"
+    for attempt in range(max_retries):
+        if winner["model"] not in (None, model):
+            return model, None, "Preempted"
+
+        retry_after = 0
+        try:
+            async with client.stream(
+                "POST",
+                "https://openrouter.ai/api/v1/chat/completions",
+                content=orjson.dumps(body)
+            ) as response:
+                if response.status_code == 200:
+                    parts = []
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        payload = line[len("data: "):]
+                        if payload == "[DONE]":
+                            break
+                        delta = orjson.loads(payload)["choices"][0]["delta"].get("content")
+                        if not delta:
+                            continue
+                        # Single event loop, no await between check and set,
+                        # so this claim is race-free
+                        if winner["model"] is None:
+                            winner["model"] = model
+                        if winner["model"] != model:
+                            return model, None, "Preempted"
+                        parts.append(delta)
+                        chunks.put(delta)
+
+                    translated_text = "".join(parts)
+                    if len(translated_text.strip()) > 10:
+                        return model, translated_text, None
+                    _release_claim(winner, model)
+                    return model, None, "Empty response"
+
+                error_msg = f"HTTP {response.status_code}"
+                if response.status_code == 429:
+                    error_msg = "Rate limited"
+                elif response.status_code == 503:
+                    error_msg = "Service overloaded"
+
+                if response.status_code in (429, 503) and attempt < max_retries - 1:
+                    retry_after = _retry_after_seconds(response)
+                else:
+                    return model, None, error_msg
+
+        except httpx.TimeoutException:
+            _release_claim(winner, model)
+            return model, None, "Timeout"
+        except Exception as e:
+            _release_claim(winner, model)
+            return model, None, f"Error: {str(e)[:50]}"
+
+        if retry_after > RETRY_AFTER_BUDGET:
+            return model, None, error_msg
+        # Honor the server's hint when given, else back off 1s, 2s, ...
+        # with jitter so concurrent users don't retry in lockstep
+        delay = min(retry_after or 2 ** attempt, 8) + random.uniform(0, 0.5)
+        await asyncio.sleep(delay)
+
+    return model, None, error_msg
+
+async def smart_translate_humor(client, model_stats, chunks, models, input_text,
+                                target_culture, max_attempts=3):
+    """
+    Race multiple free models concurrently; the first one to start producing
+    tokens wins and its deltas are forwarded to `chunks` as they arrive.
+    Runs on the background loop, so it must not touch Streamlit widgets.
+    Returns: (translated_text, model_used, attempts)
+    """
+    prompt = (
+        f"Translate or adapt the following joke or phrase into humor suitable for {target_culture} culture. "
+        f"Maintain the spirit of the joke but make it funny and understandable to that culture.\n\n"
+        f"Input: {input_text}\n\nTranslated Humor:"
+    )
+
+    attempts = []
+    candidates = _rank_models(model_stats, models)[:max_attempts]
+    winner = {"model": None}
+
+    start = time.monotonic()
+    tasks = [
+        asyncio.create_task(_stream_model(client, model, prompt, winner, chunks))
+        for model in candidates
+    ]
+
+    try:
+        for coro in asyncio.as_completed(tasks):
+            model, translated_text, error_msg = await coro
+            if error_msg == "Preempted":
+                # Lost the race through no fault of its own; don't count it
+                continue
+            # All tasks start together, so time-since-start is this model's latency
+            elapsed = time.monotonic() - start
+            _record_attempt(model_stats, model, translated_text is not None, elapsed)
+            model_name = model.split('/')[-1]
+
+            if translated_text:
+                attempts.append(f"Attempt {len(attempts)+1}: {model_name}")
+                return translated_text, model, attempts
+
+            attempts.append(f"Attempt {len(attempts)+1}: {model_name} - {error_msg}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        chunks.put(_STREAM_DONE)
+
+    return None, None, attempts
+
+def _normalize_cache_key(text):
+    """Collapse whitespace so trivially different inputs share a cache entry."""
+    return " ".join(text.split())
+
+CACHE_TTL = 3600
+CACHE_MAX_ENTRIES = 512
+
+@st.cache_resource
+def get_translation_cache():
+    """
+    In-process cache of finished translations. An explicit dict rather than
+    an @st.cache_data wrapper because streamed runs only know their result
+    after the generator is exhausted.
+    """
+    return {"lock": threading.Lock(), "entries": collections.OrderedDict()}
+
+def cache_lookup(key):
+    """Return the cached (text, model, attempts) for key, or None."""
+    cache = get_translation_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > CACHE_TTL:
+            del cache["entries"][key]
+            return None
+        cache["entries"].move_to_end(key)
+        return value
+
+def cache_store(key, value):
+    """Store a successful translation, evicting the oldest past the cap."""
+    cache = get_translation_cache()
+    with cache["lock"]:
+        cache["entries"][key] = (time.monotonic(), value)
+        cache["entries"].move_to_end(key)
+        while len(cache["entries"]) > CACHE_MAX_ENTRIES:
+            cache["entries"].popitem(last=False)
+
+def translate_stream(input_text, target_culture, max_attempts):
+    """
+    Start a streaming translation on the background loop. Returns a sync
+    generator of text deltas (for st.write_stream) and the future holding
+    the final (translated_text, model_used, attempts).
+    """
+    chunks = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        smart_translate_humor(get_http_client(), get_model_stats(), chunks,
+                              get_free_models(), input_text, target_culture,
+                              max_attempts),
+        get_event_loop()
+    )
+
+    def chunk_gen():
+        while True:
+            chunk = chunks.get()
+            if chunk is _STREAM_DONE:
+                break
+            yield chunk
+
+    return chunk_gen(), future
+
+# -------------------- UI --------------------
+# Build the shared Supabase client eagerly so the first login doesn't pay
+# for it (and a bad URL/key fails loudly at startup, not mid-login)
+get_supabase_client()
+
+st.title("🌍 Cross-Culture Humor Mapper")
+st.markdown("**Translate humor between cultures with AI-powered fun! 😄**")
+
+# -------------------- AUTH SECTION --------------------
+if "logged_in" not in st.session_state:
+    tab_login, tab_signup = st.tabs(["🔑 Login", "Signup"])
+
+    with tab_login:
+        email = st.text_input("Email", key="login_email")
+        password = st.text_input("Password", type="password", key="login_password")
+        if st.button("Login", use_container_width=True):
+            login(email, password)
+
+    with tab_signup:
+        email = st.text_input("Email", key="signup_email")
+        password = st.text_input("Password", type="password", key="signup_password")
+        if st.button("Sign Up", use_container_width=True):
+            signup(email, password)
+
+else:
+    st.success(f"✅ Logged in as {st.session_state['user_email']}")
+    report_save_failures()
+    
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if st.button("Logout", use_container_width=True):
+            logout()
+    with col2:
+        if st.button("View History", use_container_width=True):
+            st.session_state["show_history"] = True
+
+    st.divider()
+    
+    if st.session_state.get("show_history"):
+        st.subheader("📜 Your Translation History")
+        translations = get_user_translations()
+        
+        if translations:
+            for i, translation in enumerate(translations):
+                row_id = translation["id"]
+                with st.expander(f"Translation {i+1} - {translation['target_culture']}"):
+                    st.caption(f"Created: {translation.get('created_at', '')}")
+                    if st.session_state.get(f"opened_{row_id}") or \
+                            st.button("Show translation", key=f"open_{row_id}"):
+                        st.session_state[f"opened_{row_id}"] = True
+                        try:
+                            body = fetch_translation_body(row_id)
+                        except Exception as e:
+                            st.error(f"❌ Failed to load translation: {e}")
+                        else:
+                            st.write(f"**Original:** {body['original_text']}")
+                            st.write(f"**Translated:** {body['translated_text']}")
+                            st.caption(f"Model: {body['model_used']}")
+        else:
+            st.info("No translations saved yet. Start translating below!")
+        
+        if st.button("Back to Translator"):
+            st.session_state["show_history"] = False
+        st.divider()
+
+    if not st.session_state.get("show_history"):
+        st.subheader("Humor Translator")
+        
+        input_text = st.text_area(
+            "Enter a joke or funny phrase:", 
+            placeholder="Type something like 'Why did the chicken cross the road?'",
+            height=100
+        )
+        
+        col1, col2 = st.columns([2, 1])
+        
+        with col1:
+            target_culture = st.text_input(
+                "Target culture:", 
+                placeholder="e.g., Japanese, Indian, German, Corporate, Gen Z"
+            )
+        
+        with col2:
+            max_attempts = st.selectbox("Models to try", [1, 2, 3], index=2, help="How many AI models to try if one fails")
+
+        with st.expander("⚙️ Advanced Options"):
+            save_translation = st.checkbox("Save to my history", value=True)
+            show_debug = st.checkbox("Show debug information", value=False)
+
+        if st.button("Translate Humor 🎉", use_container_width=True, type="primary"):
+            if not input_text or not target_culture:
+                st.warning("Please fill in both fields.")
+            else:
+                status = st.status("Finding the best AI model for your humor... 🤖💬")
+                norm_text = _normalize_cache_key(input_text)
+                norm_culture = _normalize_cache_key(target_culture).lower()
+                cache_key = (norm_text, norm_culture)
+
+                cached = cache_lookup(cache_key)
+                if cached:
+                    translated_text, model_used, attempts = cached
+                    st.success("✅ Culturally adapted humor:")
+                    st.markdown(translated_text)
+                else:
+                    # Reserve the banner slot so it can appear above the
+                    # text once the stream proves successful
+                    banner_slot = st.empty()
+                    stream_slot = st.empty()
+                    chunk_gen, future = translate_stream(norm_text, norm_culture, max_attempts)
+                    with stream_slot:
+                        st.write_stream(chunk_gen)
+                    translated_text, model_used, attempts = future.result()
+                    if translated_text:
+                        banner_slot.success("✅ Culturally adapted humor:")
+                        # Re-render the final text: if a claimant failed
+                        # mid-stream, its partial output may have leaked in
+                        # before the eventual winner took over
+                        stream_slot.markdown(translated_text)
+                        cache_store(cache_key, (translated_text, model_used, attempts))
+                    else:
+                        # Don't leave a failed claimant's partial text above
+                        # the error message
+                        stream_slot.empty()
+
+                # One container for the whole attempt history instead of a
+                # widget per attempt
+                with status:
+                    for attempt in attempts:
+                        st.write(f"- {attempt}")
+                if translated_text:
+                    status.update(label=f"✅ Answered by {model_used.split('/')[-1]}",
+                                  state="complete")
+                else:
+                    status.update(label="😵 All AI models failed", state="error")
+
+                if translated_text:
+                    lang_code = LANG_MAP.get(target_culture.strip().lower(), "en-US")
+                    components.html(
+                        TTS_TEMPLATE.format(
+                            text=orjson.dumps(translated_text).decode(),
+                            lang=orjson.dumps(lang_code).decode()
+                        ),
+                        height=60
+                    )
+
+                    if save_translation and model_used:
+                        save_translation_to_db(input_text, target_culture, translated_text, model_used)
+                        st.info("💾 Saving to your history...")
+
+                    st.session_state.last_translation = {
+                        "original": input_text,
+                        "target": target_culture,
+                        "translated": translated_text,
+                        "model": model_used
+                    }
+
+                else:
+                    st.error("😵 All AI models failed! Expand the status above to see what happened.")
+                    st.info("""
+                    **💡 What to do now:**
+                    - Wait 5-10 minutes and try again
+                    - Try a shorter or simpler joke
+                    - Reduce the number of models to try
+                    - Free AI models often get busy during peak times
+                    """)
+
+        if show_debug:
+            st.divider()
+            st.subheader("🔧 Debug Information")
+            st.write("**Available free models:**")
+            live_models = get_free_models()
+            for i, model in enumerate(live_models[:5]):
+                st.write(f"{i+1}. {model}")
+            if len(live_models) > 5:
+                st.caption(f"... and {len(live_models) - 5} more backup models")
+            if 'last_translation' in st.session_state:
+                st.write("**Last translation:**")
+                st.json(st.session_state.last_translation)
+
+        st.divider()
+        st.subheader("💡 Quick Tips")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown("**Popular Cultures:**")
+            st.write("- Indian")
+            st.write("- Japanese")
+            st.write("- Gen Z")
+        with col2:
+            st.markdown("**Example Jokes:**")
+            st.write("- 'Knock knock' jokes")
+            st.write("- Puns")
+            st.write("- Meme phrases")
+        with col3:
+            st.markdown("**Best Practices:**")
+            st.write("- Be specific")
+            st.write("- Keep it clean")
+            st.write("- Have fun! 😄")
+
+st.markdown("---")
+st.caption("Powered by multiple free AI models | Automatic fallback system | Your humor, globally understood!")